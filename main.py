@@ -1,9 +1,16 @@
+import bisect
+import hmac
 import os
-from datetime import datetime, timezone
-from typing import List, Optional, Dict, Any
+import secrets
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Dict, Any, FrozenSet, Set, Tuple
 from fastapi import FastAPI, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr, validator
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, Field, validator
 from enum import Enum
 
 # ==========================
@@ -14,6 +21,12 @@ class DiscountType(str, Enum):
     PERCENT = "PERCENT"
 
 
+# Integer encoding of DiscountType used by the precomputed coupon metadata
+DISCOUNT_KIND_FLAT = 0
+DISCOUNT_KIND_PERCENT = 1
+DISCOUNT_KIND = {DiscountType.FLAT: DISCOUNT_KIND_FLAT, DiscountType.PERCENT: DISCOUNT_KIND_PERCENT}
+
+
 class Eligibility(BaseModel):
     allowedUserTiers: Optional[List[str]] = Field(default=None, description="Allowed user tiers (e.g., BRONZE/SILVER/GOLD)")
     minLifetimeSpend: Optional[float] = Field(default=None, ge=0)
@@ -25,6 +38,13 @@ class Eligibility(BaseModel):
     excludedCategories: Optional[List[str]] = None
     minItemsCount: Optional[int] = Field(default=None, ge=0)
 
+    @validator("allowedUserTiers", "allowedCountries", "applicableCategories", "excludedCategories")
+    def canonicalize_codes(cls, v):
+        # Matching is case-insensitive; store upper-cased, de-duplicated, interned values
+        if v is None:
+            return v
+        return sorted({sys.intern(x.upper()) for x in v})
+
 
 class Coupon(BaseModel):
     code: str = Field(..., min_length=1, max_length=64)
@@ -58,6 +78,10 @@ class CartItem(BaseModel):
     unitPrice: float = Field(..., ge=0)
     quantity: int = Field(..., ge=1)
 
+    @validator("category")
+    def canonicalize_category(cls, v):
+        return sys.intern(v.upper())
+
 
 class Cart(BaseModel):
     items: List[CartItem]
@@ -79,6 +103,10 @@ class UserInfo(BaseModel):
     lifetimeSpend: float = Field(default=0, ge=0)
     ordersPlaced: int = Field(default=0, ge=0)
 
+    @validator("userTier", "country")
+    def canonicalize_codes(cls, v):
+        return sys.intern(v.upper()) if v is not None else v
+
 
 class BestCouponInput(BaseModel):
     user: UserInfo
@@ -86,8 +114,70 @@ class BestCouponInput(BaseModel):
     evaluateUsageImpact: Optional[bool] = False
 
 
+@dataclass(slots=True, frozen=True)
+class UserCtx:
+    """Per-request user scalars, derived once before scanning coupons."""
+    user_id: str
+    tier_up: str
+    country_up: str
+    spend: float
+    orders: int
+
+    @classmethod
+    def from_user(cls, user: UserInfo) -> "UserCtx":
+        return cls(
+            user_id=user.userId,
+            tier_up=user.userTier or "",
+            country_up=user.country or "",
+            spend=user.lifetimeSpend,
+            orders=user.ordersPlaced,
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class CartCtx:
+    """Per-request cart aggregates, derived once before scanning coupons."""
+    total: float
+    items_count: int
+    cats_up: FrozenSet[str]
+
+    @classmethod
+    def from_cart(cls, cart: Cart) -> "CartCtx":
+        # Single pass over the items instead of one per Cart aggregate method
+        total = 0.0
+        count = 0
+        cats = set()
+        for item in cart.items:
+            total += item.unitPrice * item.quantity
+            count += item.quantity
+            cats.add(item.category)
+        return cls(total=total, items_count=count, cats_up=frozenset(cats))
+
+
+@dataclass(slots=True, frozen=True)
+class CouponMeta:
+    """Immutable per-coupon data precomputed at creation for the best-coupon scan."""
+    start_ns: int
+    end_ns: int
+    # Tie-break ordering among equal discounts: earliest endDate, then smaller code
+    tiebreak: Tuple[int, str]
+    usage_limit: int
+    first_order: bool
+    min_orders: int
+    min_spend: float
+    min_cart: float
+    min_items: int
+    # (kind, value, cap) for _discount_kernel; a negative cap encodes "uncapped"
+    disc: Tuple[int, float, float]
+    tiers_up: FrozenSet[str]
+    countries_up: FrozenSet[str]
+    apply_up: FrozenSet[str]
+    excl_up: FrozenSet[str]
+
+
 class LoginRequest(BaseModel):
-    email: EmailStr
+    # Plain str: only the fixed demo account is accepted, so full email validation is unnecessary
+    email: str
     password: str
 
 
@@ -99,7 +189,7 @@ class LoginResponse(BaseModel):
 # ==========================
 # Application Setup
 # ==========================
-app = FastAPI(title="Coupon Management API", version="1.0.0")
+app = FastAPI(title="Coupon Management API", version="1.0.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -114,86 +204,159 @@ app.add_middleware(
 # ==========================
 # Coupons keyed by code (case-sensitive per spec)
 COUPONS: Dict[str, Coupon] = {}
-# Usage counts per coupon code -> userId -> count
-USAGE: Dict[str, Dict[str, int]] = {}
+# Usage counts per (coupon code, userId) -> count
+USAGE: Dict[Tuple[str, str], int] = {}
+# Serialized JSON per coupon code; coupons are immutable once stored
+COUPON_JSON: Dict[str, bytes] = {}
+# Precomputed per-coupon lookup data keyed by code (built once in create_coupon)
+COUPON_META: Dict[str, CouponMeta] = {}
+# All coupon codes in tie-break order (endDate asc, code asc), maintained by create_coupon
+COUPON_ORDER: List[str] = []
+# Inverted indexes: value -> codes restricted to it, plus codes without that restriction
+BY_TIER: Dict[str, Set[str]] = {}
+BY_COUNTRY: Dict[str, Set[str]] = {}
+BY_CATEGORY: Dict[str, Set[str]] = {}
+UNRESTRICTED_TIER: Set[str] = set()
+UNRESTRICTED_COUNTRY: Set[str] = set()
+UNRESTRICTED_CAT: Set[str] = set()
 
 
 # ==========================
 # Utility Functions
 # ==========================
 
-def now_utc() -> datetime:
-    return datetime.now(timezone.utc)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
+def to_epoch_ns(dt: datetime) -> int:
+    # Naive datetimes are treated as UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1) * 1000
 
-def is_within_validity(coupon: Coupon, ref: Optional[datetime] = None) -> bool:
-    t = ref or now_utc()
-    return coupon.startDate <= t <= coupon.endDate
+
+def is_within_validity(meta: CouponMeta, now_ns: int) -> bool:
+    return meta.start_ns <= now_ns <= meta.end_ns
 
 
 def user_usage_for_coupon(code: str, user_id: str) -> int:
-    return USAGE.get(code, {}).get(user_id, 0)
+    return USAGE.get((code, user_id), 0)
 
 
-def check_eligibility(coupon: Coupon, user: UserInfo, cart: Cart) -> bool:
-    # User tier
-    if coupon.eligibility.allowedUserTiers:
-        if (user.userTier or "").upper() not in {t.upper() for t in coupon.eligibility.allowedUserTiers}:
-            return False
+def build_coupon_meta(coupon: Coupon) -> CouponMeta:
+    """Validity window, eligibility rules and discount scalars, computed once per coupon instead of per request.
 
-    # Country
-    if coupon.eligibility.allowedCountries:
-        if (user.country or "").upper() not in {c.upper() for c in coupon.eligibility.allowedCountries}:
-            return False
+    Optional numeric minimums are stored as 0 when unset: user and cart values are
+    non-negative, so the comparison then always passes and needs no None check.
+    """
+    elig = coupon.eligibility
+    end_ns = to_epoch_ns(coupon.endDate)
+    return CouponMeta(
+        start_ns=to_epoch_ns(coupon.startDate),
+        end_ns=end_ns,
+        tiebreak=(end_ns, coupon.code),
+        usage_limit=coupon.usageLimitPerUser,
+        first_order=bool(elig.firstOrderOnly),
+        min_orders=elig.minOrdersPlaced or 0,
+        min_spend=float(elig.minLifetimeSpend or 0),
+        min_cart=float(elig.minCartValue or 0),
+        min_items=elig.minItemsCount or 0,
+        disc=(
+            DISCOUNT_KIND[coupon.discountType],
+            float(coupon.discountValue),
+            float(coupon.maxDiscountAmount) if coupon.maxDiscountAmount is not None else -1.0,
+        ),
+        tiers_up=frozenset(elig.allowedUserTiers or ()),
+        countries_up=frozenset(elig.allowedCountries or ()),
+        apply_up=frozenset(elig.applicableCategories or ()),
+        excl_up=frozenset(elig.excludedCategories or ()),
+    )
+
+
+def index_coupon(code: str, meta: CouponMeta) -> None:
+    for values, index, unrestricted in (
+        (meta.tiers_up, BY_TIER, UNRESTRICTED_TIER),
+        (meta.countries_up, BY_COUNTRY, UNRESTRICTED_COUNTRY),
+        (meta.apply_up, BY_CATEGORY, UNRESTRICTED_CAT),
+    ):
+        if not values:
+            unrestricted.add(code)
+        for value in values:
+            index.setdefault(value, set()).add(code)
+
+
+def candidate_codes(user: UserCtx, cart: CartCtx) -> Set[str]:
+    """Codes whose tier/country/applicable-category rules can match this request."""
+    codes = UNRESTRICTED_TIER | BY_TIER.get(user.tier_up, set())
+    # Narrow by membership rather than building full-size unions for the other rules;
+    # with no restricted coupons for a rule every code passes it, so skip the filter
+    if BY_COUNTRY:
+        country_codes = BY_COUNTRY.get(user.country_up, set())
+        codes = {c for c in codes if c in UNRESTRICTED_COUNTRY or c in country_codes}
+    if BY_CATEGORY:
+        cat_codes = [BY_CATEGORY[cat] for cat in cart.cats_up if cat in BY_CATEGORY]
+        codes = {c for c in codes if c in UNRESTRICTED_CAT or any(c in group for group in cat_codes)}
+    return codes
+
+
+def check_eligibility(meta: CouponMeta, user: UserCtx, cart: CartCtx) -> bool:
+    # Checks run cheapest-first so most ineligible coupons exit early;
+    # set lookups and category intersections come last.
 
     # First order only
-    if coupon.eligibility.firstOrderOnly and user.ordersPlaced != 0:
+    if meta.first_order and user.orders != 0:
         return False
 
     # Orders placed minimum
-    if coupon.eligibility.minOrdersPlaced is not None and user.ordersPlaced < coupon.eligibility.minOrdersPlaced:
+    if user.orders < meta.min_orders:
         return False
 
     # Lifetime spend minimum
-    if coupon.eligibility.minLifetimeSpend is not None and user.lifetimeSpend < coupon.eligibility.minLifetimeSpend:
+    if user.spend < meta.min_spend:
         return False
 
     # Min cart value
-    cart_total = cart.total_value()
-    if coupon.eligibility.minCartValue is not None and cart_total < coupon.eligibility.minCartValue:
+    if cart.total < meta.min_cart:
         return False
 
     # Min items count
-    if coupon.eligibility.minItemsCount is not None and cart.total_items_count() < coupon.eligibility.minItemsCount:
+    if cart.items_count < meta.min_items:
+        return False
+
+    # User tier
+    if meta.tiers_up and user.tier_up not in meta.tiers_up:
+        return False
+
+    # Country
+    if meta.countries_up and user.country_up not in meta.countries_up:
         return False
 
     # Applicable/excluded categories
-    cats = {c.upper() for c in cart.categories()}
-    if coupon.eligibility.applicableCategories:
-        allowed = {c.upper() for c in coupon.eligibility.applicableCategories}
-        if cats.isdisjoint(allowed):
-            return False
-    if coupon.eligibility.excludedCategories:
-        excluded = {c.upper() for c in coupon.eligibility.excludedCategories}
-        if not cats.isdisjoint(excluded):
-            return False
+    if meta.apply_up and cart.cats_up.isdisjoint(meta.apply_up):
+        return False
+    if meta.excl_up and not cart.cats_up.isdisjoint(meta.excl_up):
+        return False
 
     return True
 
 
-def calculate_discount(coupon: Coupon, cart: Cart) -> float:
-    cart_value = cart.total_value()
+def _discount_kernel(kind: int, value: float, cap: float, cart_value: float) -> float:
     discount = 0.0
-    if coupon.discountType == DiscountType.FLAT:
-        discount = float(coupon.discountValue)
-    elif coupon.discountType == DiscountType.PERCENT:
-        discount = cart_value * (float(coupon.discountValue) / 100.0)
-        if coupon.maxDiscountAmount is not None:
-            discount = min(discount, float(coupon.maxDiscountAmount))
+    if kind == DISCOUNT_KIND_FLAT:
+        discount = value
+    elif kind == DISCOUNT_KIND_PERCENT:
+        discount = cart_value * (value / 100.0)
+        if cap >= 0:
+            discount = min(discount, cap)
     # Discount cannot exceed cart total
     return max(0.0, min(discount, cart_value))
 
 
+def calculate_discount(disc: Tuple[int, float, float], cart_value: float) -> float:
+    kind, value, cap = disc
+    return _discount_kernel(kind, value, cap, cart_value)
+
+
 def best_coupon(user: UserInfo, cart: Cart, evaluate_usage_impact: bool = False) -> Optional[Dict[str, Any]]:
     """
     Returns a dict containing coupon and computed discount or None.
@@ -202,47 +365,55 @@ def best_coupon(user: UserInfo, cart: Cart, evaluate_usage_impact: bool = False)
       2) Earliest endDate
       3) Lexicographically smaller code
     """
-    candidates = []
-    reference_time = now_utc()
-    for code, coupon in COUPONS.items():
+    best: Optional[Coupon] = None
+    best_disc = -1.0
+    now_ns = time.time_ns()
+    # Derive user fields and cart aggregates once per request rather than once per coupon
+    user_ctx = UserCtx.from_user(user)
+    cart_ctx = CartCtx.from_cart(cart)
+    # No discount can exceed the cart total, so reaching it ends the search
+    max_disc = round(cart_ctx.total, 2)
+    codes = candidate_codes(user_ctx, cart_ctx)
+    # Visit candidates in tie-break order (endDate asc, code asc): the first coupon
+    # reaching a given discount is then the tie-break winner among equals.
+    # Sorting a small candidate set beats walking every stored code; past roughly
+    # 1/16 of all coupons, filtering the precomputed COUPON_ORDER is cheaper.
+    if len(codes) * 16 < len(COUPON_ORDER):
+        ordered = sorted(codes, key=lambda c: COUPON_META[c].tiebreak)
+    else:
+        ordered = [c for c in COUPON_ORDER if c in codes]
+    for code in ordered:
+        meta = COUPON_META[code]
         # Validity window
-        if not is_within_validity(coupon, reference_time):
+        if not is_within_validity(meta, now_ns):
             continue
         # Usage limit per user
-        if user_usage_for_coupon(code, user.userId) >= coupon.usageLimitPerUser:
+        if user_usage_for_coupon(code, user_ctx.user_id) >= meta.usage_limit:
             continue
         # Eligibility
-        if not check_eligibility(coupon, user, cart):
+        if not check_eligibility(meta, user_ctx, cart_ctx):
             continue
-        disc = calculate_discount(coupon, cart)
+        disc = calculate_discount(meta.disc, cart_ctx.total)
         if disc <= 0:
             continue
-        candidates.append({
-            "coupon": coupon,
-            "discount": round(disc, 2),
-        })
+        disc = round(disc, 2)
+        if disc > best_disc:
+            best, best_disc = COUPONS[code], disc
+            if best_disc >= max_disc:
+                break
 
-    if not candidates:
+    if best is None:
         return None
 
-    # Deterministic selection with tie breakers
-    # Sort by: -discount (desc), endDate (asc), code (asc)
-    candidates.sort(key=lambda x: (
-        -x["discount"],
-        x["coupon"].endDate,
-        x["coupon"].code
-    ))
-
-    top = candidates[0]
     result: Dict[str, Any] = {
-        "coupon": top["coupon"],
-        "computedDiscount": top["discount"],
+        "coupon": best,
+        "computedDiscount": best_disc,
     }
     if evaluate_usage_impact:
         # Projected usage if applied now
-        current = user_usage_for_coupon(top["coupon"].code, user.userId)
+        current = user_usage_for_coupon(best.code, user_ctx.user_id)
         result["projectedUsageForUser"] = current + 1
-        result["usageLimitPerUser"] = top["coupon"].usageLimitPerUser
+        result["usageLimitPerUser"] = best.usageLimitPerUser
     return result
 
 
@@ -261,15 +432,17 @@ def create_coupon(coupon: Coupon):
         raise HTTPException(status_code=400, detail="Duplicate coupon code")
     # Store
     COUPONS[code] = coupon
-    # Initialize usage map
-    if code not in USAGE:
-        USAGE[code] = {}
+    COUPON_META[code] = build_coupon_meta(coupon)
+    index_coupon(code, COUPON_META[code])
+    bisect.insort(COUPON_ORDER, code, key=lambda c: COUPON_META[c].tiebreak)
+    COUPON_JSON[code] = coupon.model_dump_json().encode()
     return coupon
 
 
 @app.get("/coupons", response_model=List[Coupon])
 def list_coupons():
-    return list(COUPONS.values())
+    # Join the pre-serialized coupons instead of re-encoding every model per request
+    return Response(content=b"[" + b",".join(COUPON_JSON.values()) + b"]", media_type="application/json")
 
 
 @app.post("/best-coupon")
@@ -290,16 +463,21 @@ def get_best_coupon(payload: BestCouponInput):
 
 DEMO_EMAIL = "hire-me@anshumat.org"
 DEMO_PASSWORD = "HireMe@2025!"
+DEMO_USER_ID = "user-1"
+DEMO_EMAIL_BYTES = DEMO_EMAIL.encode()
+DEMO_PASSWORD_BYTES = DEMO_PASSWORD.encode()
 
 
 @app.post("/login", response_model=LoginResponse)
 def login(body: LoginRequest = Body(...)):
-    if body.email.lower() != DEMO_EMAIL or body.password != DEMO_PASSWORD:
+    # Evaluate both comparisons (constant-time) so timing does not reveal which one failed
+    email_ok = hmac.compare_digest(body.email.lower().encode(), DEMO_EMAIL_BYTES)
+    password_ok = hmac.compare_digest(body.password.encode(), DEMO_PASSWORD_BYTES)
+    if not (email_ok and password_ok):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    # Fake token & user id (derived for demo)
-    token = "fake-token-" + str(hash(body.email))
-    user_id = "user-" + str(abs(hash(body.email)) % 10_000)
-    return LoginResponse(token=token, userId=user_id)
+    # Fake token (random per login) & fixed demo user id
+    token = "fake-token-" + secrets.token_urlsafe(24)
+    return LoginResponse(token=token, userId=DEMO_USER_ID)
 
 
 # Helper endpoint to simulate applying a coupon (increments usage)
@@ -313,11 +491,18 @@ def use_coupon(code: str, body: UserInfo):
     limit = COUPONS[code].usageLimitPerUser
     if current >= limit:
         raise HTTPException(status_code=429, detail="Usage limit reached for this user")
-    USAGE.setdefault(code, {})[body.userId] = current + 1
+    USAGE[(code, body.userId)] = current + 1
     return {"code": code, "userId": body.userId, "newUsage": current + 1, "limit": limit}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Storage is in-memory and per process, so more than one worker only makes
+    # sense when every worker can serve from its own coupon set.
+    workers = int(os.getenv("WORKERS", 1))
+    # uvicorn needs an import string to spawn workers; for a single process pass the
+    # app object so this module is not imported (and its stores built) a second time
+    target = "main:app" if workers > 1 else app
+    # "auto" picks uvloop/httptools when installed (uvloop is skipped on Windows)
+    uvicorn.run(target, host="0.0.0.0", port=port, loop="auto", http="auto", workers=workers)